@@ -1,13 +1,40 @@
 import os
-import json
+import gzip
+import time
+import sqlite3
+import hashlib
+import atexit
+import asyncio
+import logging
+import threading
+import orjson
 import requests
+from types import MappingProxyType
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
 # WordPress REST API configuration
 WORDPRESS_URL = "https://onlineappflex.wpenginepowered.com"  # Update this to your WordPress site URL
 API_BASE = f"{WORDPRESS_URL}/wp-json/cars-scraper/v1"
+_UPDATE_URL = f"{API_BASE}/update-cars-data"
+
+# WordPress application password credentials, read from the environment
+_USERNAME = os.environ.get("WP_USER", "Puneet")
+_APP_PASSWORD = os.environ.get("WP_APP_PASSWORD")
+_AUTH = HTTPBasicAuth(_USERNAME, _APP_PASSWORD) if _APP_PASSWORD else None
+
+_HEADERS = MappingProxyType({
+    'Content-Type': 'application/json',
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+})
+_GZIP_HEADERS = MappingProxyType({'Content-Encoding': 'gzip'})
 
-FIELDS = [
+FIELDS = frozenset([
     'id', 'title', 'price', 'mileage', 'exterior_color', 'interior_color',
     'engine', 'transmission', 'drivetrain', 'fuel_type', 'mpg', 'vin',
     'stock_', 'features_exterior', 'features_seating', 'features_safety',
@@ -16,7 +43,127 @@ FIELDS = [
     'start_payment', 'payment_breakdown', 'status_flag',
     'make', 'model', 'year',
     'bodystyle'
-]
+])
+
+# Columns stored as JSON text. Only these are encoded when given as Python
+# containers; every other value is left for the single payload serialization.
+JSON_FIELDS = frozenset({'images', 'payment_breakdown'})
+
+# --- Pooled HTTP session ---
+# Every request goes to the same WordPress host, so one keep-alive session
+# avoids a fresh TCP + TLS handshake per call.
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=32,
+    # Transient failures are retried on the same keep-alive pool; POST is
+    # included because the update endpoint is an idempotent upsert
+    max_retries=Retry(
+        total=5,
+        connect=3,
+        read=3,
+        status=3,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({"GET", "POST"}),
+        respect_retry_after_header=True
+    )
+))
+_SESSION.headers.update(_HEADERS)
+_SESSION.auth = _AUTH
+atexit.register(_SESSION.close)
+# Request bodies are gzip-compressed until the server turns that down once
+_gzip_bodies = True
+
+# Cars sent per update request
+_CHUNK_SIZE = 100
+
+# Validators and rows from the last get-cars-data response, keyed by limit
+_ETAG_CACHE = {}
+
+# --- Change detection ---
+# Hash of the last successfully sent version of each car, keyed by VIN, so
+# unchanged cars are not posted again on the next run. SQLite locks the file,
+# so several server processes can share it. Hashes older than _HASH_TTL are
+# ignored, so a car WordPress lost is sent again within a day; pass
+# force=True to update_wordpress_database to resend everything at once.
+_HASH_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "car_hashes.sqlite3")
+_HASH_TTL = 24 * 60 * 60
+_HASH_LOCK = threading.Lock()
+_hash_db = None
+
+def _open_hash_db(path):
+    conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS car_hashes "
+        "(key TEXT PRIMARY KEY, digest TEXT NOT NULL, sent_at REAL NOT NULL)"
+    )
+    conn.commit()
+    return conn
+
+def _get_hash_db():
+    # Callers hold _HASH_LOCK, so the connection is never used by two threads at once
+    global _hash_db
+    if _hash_db is None:
+        try:
+            _hash_db = _open_hash_db(_HASH_CACHE_PATH)
+        except sqlite3.Error:
+            logger.warning("Could not open %s, change detection is kept in memory", _HASH_CACHE_PATH)
+            _hash_db = _open_hash_db(":memory:")
+    return _hash_db
+
+def _sent_hashes(keys):
+    """Hashes sent within _HASH_TTL for the given keys"""
+    marks = ",".join("?" * len(keys))
+    try:
+        with _HASH_LOCK:
+            rows = _get_hash_db().execute(
+                f"SELECT key, digest FROM car_hashes WHERE sent_at > ? AND key IN ({marks})",
+                (time.time() - _HASH_TTL, *keys)
+            ).fetchall()
+    except sqlite3.Error:
+        logger.exception("Reading sent car hashes failed, sending every car")
+        return {}
+    return dict(rows)
+
+def _record_hashes(hashes):
+    now = time.time()
+    try:
+        with _HASH_LOCK:
+            with _get_hash_db() as conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO car_hashes (key, digest, sent_at) VALUES (?, ?, ?)",
+                    [(key, digest, now) for key, digest in hashes.items()]
+                )
+    except sqlite3.Error:
+        logger.exception("Recording sent car hashes failed")
+
+def _close_hash_cache():
+    with _HASH_LOCK:
+        if _hash_db is not None:
+            _hash_db.close()
+
+atexit.register(_close_hash_cache)
+
+# --- Batched single-record updates ---
+# dynamic_insert_or_update buffers records and sends them in batches of
+# _BATCH_SIZE, or every _FLUSH_INTERVAL seconds, instead of one POST per car.
+_PENDING = []
+_LOCK = threading.Lock()
+_BATCH_SIZE = 50
+_FLUSH_INTERVAL = 2.0
+_flusher = None
+
+# Background uploads, so callers can keep scraping while a POST is in flight.
+# At most max_workers updates share the pooled session at once.
+_POST_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="wp-post")
+
+def warm_session():
+    """Open a keep-alive connection to WordPress before the first real request needs it"""
+    try:
+        _SESSION.head(WORDPRESS_URL, timeout=5)
+    except requests.RequestException:
+        logger.warning("Could not reach %s while warming the HTTP session", WORDPRESS_URL)
 
 def get_wordpress_nonce():
     """Get WordPress nonce for authentication"""
@@ -27,51 +174,173 @@ def get_wordpress_nonce():
     except Exception:
         return None
 
-def update_wordpress_database(car_data_list):
-    """Update WordPress database via REST API"""
+def sanitize_car(car):
+    """Keep only known columns, encoding container values of JSON fields as text"""
+    return {
+        k: (orjson.dumps(v).decode() if k in JSON_FIELDS and not isinstance(v, str) else v)
+        for k, v in car.items() if k in FIELDS
+    }
+
+def _post_json(url, body):
+    """POST an encoded JSON body, gzip-compressed when the server accepts it"""
+    global _gzip_bodies
+    if _gzip_bodies:
+        response = _SESSION.post(url, data=gzip.compress(body, compresslevel=3), headers=_GZIP_HEADERS, timeout=30)
+        # Servers that don't decode request bodies answer 415, or 400 once
+        # WordPress fails to parse the compressed bytes as JSON
+        if response.status_code not in (400, 415):
+            return response
+        response = _SESSION.post(url, data=body, timeout=30)
+        if response.ok:
+            _gzip_bodies = False
+        return response
+    return _SESSION.post(url, data=body, timeout=30)
+
+def _car_key(car):
+    return car.get('vin') or car.get('id')
+
+def _car_hash(row):
+    return hashlib.blake2b(orjson.dumps(row, option=orjson.OPT_SORT_KEYS), digest_size=16).hexdigest()
+
+def _chunks(seq, n):
+    for i in range(0, len(seq), n):
+        yield seq[i:i + n]
+
+def _post_chunk(chunk, timestamp, force=False):
+    """Send the cars in one chunk that changed since they were last sent, or all of them with force"""
+    try:
+        keyed = [(str(_car_key(row)), row) for row in map(sanitize_car, chunk)]
+        sent = {} if force else _sent_hashes([key for key, _ in keyed])
+        rows = []
+        hashes = {}
+        for key, row in keyed:
+            digest = _car_hash(row)
+            if sent.get(key) != digest:
+                rows.append(row)
+                hashes[key] = digest
+        if not rows:
+            return True
+        payload = {
+            'cars_data': rows,
+            'timestamp': timestamp
+        }
+        response = _post_json(_UPDATE_URL, orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS))
+        if not response.ok:
+            logger.error("WordPress update failed with HTTP %d for %d cars", response.status_code, len(rows))
+            return False
+        _record_hashes(hashes)
+        return True
+    except Exception:
+        logger.exception("WordPress update failed for %d cars", len(chunk))
+        return False
+
+def update_wordpress_database(car_data_list, force=False):
+    """
+    Update WordPress database via REST API, _CHUNK_SIZE cars per request.
+    Cars unchanged since they were last sent are skipped unless force is set.
+    """
     try:
         # Remove 'last_updated' from each record so MySQL can auto-update it
         for car in car_data_list:
             car.pop('last_updated', None)
-        # Send data to WordPress REST API endpoint
-        username = "Puneet"
-        app_password = "MgMD pIbf hRkM EJq6 NJut n0cn"  # 24-character string
-        headers = {
-            'Content-Type': 'application/json',
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-        }
-        def sanitize_car(car):
-            return {k: (json.dumps(v) if isinstance(v, (dict, list)) else v) for k, v in car.items() if k in FIELDS}
-        payload = {
-            'cars_data': [sanitize_car(car) for car in car_data_list],
-            'timestamp': datetime.now().isoformat()
-        }
-        response = requests.post(
-            f"{API_BASE}/update-cars-data",
-            json=payload,
-            headers=headers,
-            auth=(username, app_password),
-            timeout=30
-        )
-        return response.status_code == 200
+        # Keep only the last record per VIN (falling back to the listing id);
+        # records with neither can't be upserted and are dropped
+        car_data_list = list({
+            _car_key(car): car for car in car_data_list if _car_key(car)
+        }.values())
+        # One timestamp per batch; orjson writes the naive datetime in C, in
+        # the same ISO 8601 form as isoformat()
+        timestamp = datetime.now()
+        # Only one chunk is sanitized and serialized at a time, bounding peak memory
+        results = [_post_chunk(chunk, timestamp, force) for chunk in _chunks(car_data_list, _CHUNK_SIZE)]
+        return all(results)
     except Exception:
+        logger.exception("WordPress update failed")
         return False
 
 def get_cars_data_from_wordpress(limit=100):
-    """Get cars data from WordPress via REST API"""
+    """Get cars data from WordPress via REST API, revalidating the last response"""
     try:
-        response = requests.get(f"{API_BASE}/get-cars-data?limit={limit}", timeout=10)
+        cached = _ETAG_CACHE.get(limit)
+        headers = {}
+        if cached:
+            etag, last_modified, _ = cached
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+        response = _SESSION.get(f"{API_BASE}/get-cars-data?limit={limit}", headers=headers, timeout=10)
+        if response.status_code == 304 and cached:
+            return cached[2]
         if response.status_code == 200:
-            return response.json().get('cars_data', [])
+            cars_data = orjson.loads(response.content).get('cars_data', [])
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+            if etag or last_modified:
+                _ETAG_CACHE[limit] = (etag, last_modified, cars_data)
+            return cars_data
         else:
+            logger.error("Fetching cars data from WordPress failed with HTTP %d", response.status_code)
             return []
     except Exception:
+        logger.exception("Fetching cars data from WordPress failed")
         return []
 
+def get_existing_ids(car_ids, limit=1000):
+    """Return the subset of car_ids already stored in WordPress"""
+    stored = {str(car.get('id')) for car in get_cars_data_from_wordpress(limit=limit)}
+    return {car_id for car_id in car_ids if car_id in stored}
+
+async def update_wordpress_database_async(car_data_list, force=False):
+    """Update WordPress database without blocking the running event loop"""
+    return await asyncio.to_thread(update_wordpress_database, car_data_list, force)
+
+async def get_cars_data_from_wordpress_async(limit=100):
+    """Get cars data from WordPress without blocking the running event loop"""
+    return await asyncio.to_thread(get_cars_data_from_wordpress, limit)
+
+def submit_update(car_data_list):
+    """Update WordPress database in the background; returns a Future of the result"""
+    return _POST_POOL.submit(update_wordpress_database, car_data_list)
+
+def _take_pending():
+    with _LOCK:
+        batch = _PENDING[:]
+        _PENDING.clear()
+    return batch
+
+def flush_pending():
+    """Send all buffered records to WordPress in a single update"""
+    batch = _take_pending()
+    return update_wordpress_database(batch) if batch else True
+
+def _flush_periodically():
+    while True:
+        time.sleep(_FLUSH_INTERVAL)
+        batch = _take_pending()
+        if batch:
+            submit_update(batch)
+
 def dynamic_insert_or_update(conn, car_data):
-    """Legacy function - now just updates WordPress via REST API"""
-    car_data_list = [car_data]
-    return update_wordpress_database(car_data_list)
+    """Legacy function - buffers the record and updates WordPress in batches via REST API"""
+    global _flusher
+    with _LOCK:
+        _PENDING.append(car_data)
+        full = len(_PENDING) >= _BATCH_SIZE
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_periodically, name="wp-flush", daemon=True)
+            _flusher.start()
+    if full:
+        submit_update(_take_pending())
+    return True
+
+def _shutdown():
+    # The executor refuses new work once the interpreter is exiting, so the
+    # last buffered records are sent synchronously before draining the pool
+    flush_pending()
+    _POST_POOL.shutdown(wait=True)
+
+atexit.register(_shutdown)
 
 def create_connection():
     """Legacy function - returns None since we're not using direct database connections"""
@@ -1,16 +1,18 @@
 import time
-import json
+import orjson
 import re
 import logging
+import atexit
+from queue import Queue, Empty
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import StaleElementReferenceException, TimeoutException, WebDriverException
+from selenium.common.exceptions import TimeoutException, WebDriverException
 from concurrent.futures import ThreadPoolExecutor
 import database as db
 import urllib.parse
+from functools import lru_cache
 
 # --- Setup basic console logging ---
 logging.basicConfig(
@@ -18,21 +20,52 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
+# --- Precompiled patterns ---
+_NON_ALNUM_LOWER_RE = re.compile(r'[^a-z0-9\s]')
+_NON_ALNUM_MIXED_RE = re.compile(r'[^a-zA-Z0-9\s]')
+_BODYSTYLE_RE = re.compile(r'bodystyle=([^&]+)')
+_VDETAIL_RE = re.compile(r'/vehicledetail/([^/]+)')
+
 # --- Helper Functions for Data Cleaning ---
+class _DigitsOnly(dict):
+    """str.translate table that keeps ASCII digits and drops everything else.
+
+    Entries are filled in on first sight of each character, so after warm-up
+    translate runs entirely on C-level dict hits.
+    """
+    def __missing__(self, char):
+        value = char if 0x30 <= char <= 0x39 else None
+        self[char] = value
+        return value
+
+_DIGITS_ONLY = _DigitsOnly()
+
 def clean_mileage(mileage_text):
     if not mileage_text:
         return None
     # Extract only the numbers from the mileage text
-    numbers = re.sub(r'[^0-9]', '', mileage_text)
+    numbers = mileage_text.translate(_DIGITS_ONLY)
     return int(numbers) if numbers else None
 
 def clean_payment(payment_text):
     if not payment_text:
         return None
     # Extract only the numbers from the payment text
-    numbers = re.sub(r'[^0-9]', '', payment_text)
+    numbers = payment_text.translate(_DIGITS_ONLY)
     return int(numbers) if numbers else None
 
+# Both key cleaners see a small, fixed vocabulary of labels, so results are cached
+@lru_cache(maxsize=256)
+def sanitize_key(raw_key):
+    """Turn a basics-section label into a valid database column name"""
+    # Remove special characters and replace spaces with underscores
+    return _NON_ALNUM_LOWER_RE.sub('', raw_key.strip().lower()).replace(' ', '_')
+
+@lru_cache(maxsize=256)
+def breakdown_key(title):
+    """Turn a payment-breakdown title into a dictionary key"""
+    return _NON_ALNUM_MIXED_RE.sub('', title).strip().lower().replace(' ', '_')
+
 def parse_car_title(title):
     """
     Parse car title to extract year, make, and model.
@@ -41,23 +74,33 @@ def parse_car_title(title):
     if not title:
         return {"year": None, "make": None, "model": None}
     
-    parts = title.strip().split()
-    if not parts:
-        return {"year": None, "make": None, "model": None}
-    
+    # Split at most twice: year, make, and the rest of the title as the model.
+    # The title is raw textContent, so the model's inner whitespace is collapsed.
+    parts = title.strip().split(None, 2)
     # First part is usually the year
-    year = parts[0] if parts[0].isdigit() and len(parts[0]) == 4 else None
-    
-    if year and len(parts) > 1:
-        # Second part is usually the make
-        make = parts[1]
-        # Everything after make is the model
-        model = " ".join(parts[2:]) if len(parts) > 2 else None
-        return {"year": year, "make": make, "model": model}
+    if len(parts) < 2 or len(parts[0]) != 4 or not parts[0].isdigit():
+        return {"year": None, "make": None, "model": None}
     
-    return {"year": None, "make": None, "model": None}
+    # Second part is usually the make, everything after it is the model
+    return {"year": parts[0], "make": parts[1], "model": " ".join(parts[2].split()) if len(parts) > 2 else None}
+
+def car_id_from_url(url):
+    """Listing id from a /vehicledetail/<id>/ URL, or the URL itself"""
+    match = _VDETAIL_RE.search(url)
+    return match.group(1) if match else url
+
+class ScraperError(Exception):
+    """Raised when the scraper can't run at all, e.g. Chrome fails to start"""
 
 # --- Driver Setup ---
+# Only DOM text and attributes are scraped, so these requests are never
+# fetched. Stylesheets still load: WebElement.text depends on computed styles.
+BLOCKED_URLS = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.svg",
+    "*.woff", "*.woff2", "*.ttf", "*.otf",
+    "*google-analytics*", "*googletagmanager*", "*doubleclick*", "*facebook*"
+]
+
 def setup_driver(headless=True):
     options = Options()
     if headless:
@@ -106,13 +149,21 @@ def setup_driver(headless=True):
     options.add_argument("--use-mock-keychain")
     # Add user agent to avoid detection
     options.add_argument("--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36")
+    # Don't download images; their src attributes are still in the DOM
+    options.add_argument("--blink-settings=imagesEnabled=false")
+    options.add_experimental_option("prefs", {"profile.managed_default_content_settings.images": 2})
     
-    driver = webdriver.Chrome(options=options)
+    try:
+        driver = webdriver.Chrome(options=options)
+    except WebDriverException as e:
+        raise ScraperError(f"Could not start Chrome: {e.msg}") from e
     driver.set_page_load_timeout(30)  # Reduced from 60 to 30 seconds
     driver.set_script_timeout(30)
     
     # Add additional error handling
     try:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_URLS})
         # Test the driver is working
         driver.get("data:text/html,<html><body>Test</body></html>")
     except Exception as e:
@@ -120,10 +171,70 @@ def setup_driver(headless=True):
             driver.quit()
         except:
             pass
-        raise e
+        raise ScraperError(f"Chrome started but is not usable: {e}") from e
     
     return driver
 
+# --- Driver Pool ---
+# Chrome takes a second or two to start, so drivers are kept between
+# scrape_cars calls and only replaced after _MAX_DRIVER_USES pages, which
+# bounds the memory a long-lived browser accumulates. At most
+# _MAX_IDLE_DRIVERS are kept; drivers returned beyond that by overlapping
+# runs are quit.
+_MAX_IDLE_DRIVERS = 4
+_DRIVER_POOL = Queue(maxsize=_MAX_IDLE_DRIVERS)
+_DRIVER_USAGE = {}
+_MAX_DRIVER_USES = 50
+
+def get_pooled_driver():
+    """Take a working idle driver from the pool, starting a new one if none is idle"""
+    while True:
+        try:
+            driver = _DRIVER_POOL.get_nowait()
+        except Empty:
+            return setup_driver()
+        # Chrome or chromedriver may have died while idle (crash, OOM kill)
+        try:
+            driver.current_url
+            return driver
+        except Exception:
+            _quit_driver(driver)
+
+def _count_use(driver):
+    uses = _DRIVER_USAGE.get(id(driver), 0) + 1
+    _DRIVER_USAGE[id(driver)] = uses
+    return uses
+
+def _quit_driver(driver):
+    _DRIVER_USAGE.pop(id(driver), None)
+    try:
+        driver.quit()
+    except Exception:
+        pass
+
+def return_driver(driver):
+    """Reset a driver and put it back in the pool, or quit it if it is worn out, broken or not needed"""
+    if _DRIVER_USAGE.get(id(driver), 0) >= _MAX_DRIVER_USES or _DRIVER_POOL.full():
+        _quit_driver(driver)
+        return
+    try:
+        driver.delete_all_cookies()
+        driver.execute_cdp_cmd("Network.clearBrowserCache", {})
+        _DRIVER_POOL.put_nowait(driver)
+    except Exception:
+        _quit_driver(driver)
+
+def close_driver_pool():
+    """Quit every idle pooled driver"""
+    while True:
+        try:
+            driver = _DRIVER_POOL.get_nowait()
+        except Empty:
+            break
+        _quit_driver(driver)
+
+atexit.register(close_driver_pool)
+
 # --- Utility Functions ---
 def load_page_with_retry(driver, url, max_retries=3):
     for attempt in range(max_retries):
@@ -142,61 +253,147 @@ def load_page_with_retry(driver, url, max_retries=3):
             return False
     return False
 
-def get_detail_text(driver, selector, attribute=None, max_retries=2):
-    for _ in range(max_retries):
-        try:
-            # Use a shorter wait as this function is called many times.
-            element = WebDriverWait(driver, 5).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, selector))
-            )
-            if attribute:
-                return element.get_attribute(attribute)
-            
-            # Use JS to get textContent, which is more robust for dynamic content
-            text = driver.execute_script("return arguments[0].textContent;", element)
-            return text.strip()
+# Ready once the document is parsed and the selector matches, checked in one
+# WebDriver command per poll
+_READY_JS = "return document.readyState !== 'loading' && !!document.querySelector(arguments[0]);"
 
-        except TimeoutException:
-            return None # Element not found, return None immediately
-        except StaleElementReferenceException:
-            # If element is stale, retry once.
-            time.sleep(0.5)
-            continue
-        except Exception as e:
-            return None
-    return None
+def wait_for_selector(driver, selector, timeout, poll_frequency=0.05):
+    """Wait until selector is present, polling every 50ms instead of WebDriverWait's 500ms"""
+    WebDriverWait(driver, timeout, poll_frequency=poll_frequency).until(
+        lambda d: d.execute_script(_READY_JS, selector)
+    )
+
+# Reads every static field of a detail page in a single WebDriver command,
+# instead of one round-trip per element. innerText mirrors WebElement.text.
+_DETAIL_JS = """
+return (function () {
+    function content(el) { return el ? el.textContent.trim() : null; }
+    function visible(el) { return el ? el.innerText.trim() : ''; }
+    function rows(selector) {
+        var dl = document.querySelector(selector);
+        if (!dl) { return []; }
+        var dts = dl.querySelectorAll('dt');
+        var dds = dl.querySelectorAll('dd');
+        var out = [];
+        for (var i = 0; i < Math.min(dts.length, dds.length); i++) { out.push([dts[i], dds[i]]); }
+        return out;
+    }
+    var basics = rows('.basics-section dl.fancy-description-list').map(function (row) {
+        return [visible(row[0]), visible(row[1])];
+    });
+    var features = rows('.features-section dl.fancy-description-list').map(function (row) {
+        var items = [];
+        row[1].querySelectorAll('ul.vehicle-features-list li').forEach(function (li) {
+            var item = visible(li);
+            if (item) { items.push(item); }
+        });
+        return [visible(row[0]), items];
+    });
+    var images = Array.from(document.querySelectorAll('gallery-thumbnails img'), function (img) {
+        return [img.src, img.getAttribute('modal-src'), img.getAttribute('alt')];
+    });
+    var recalls = document.querySelector("a.sds-link--ext[data-linkname='check-recalls']");
+    return {
+        title: content(document.querySelector('h1.listing-title')),
+        price: content(document.querySelector("span[data-qa='primary-price']")),
+        basics: basics,
+        features: features,
+        additional: visible(document.querySelector('.auto-corrected-feature-list')),
+        images: images,
+        bodystyle_href: recalls ? recalls.href : null
+    };
+})();
+"""
+
+# Text of every item in the all-features modal, in one WebDriver command
+_ALL_FEATURES_JS = """
+return Array.from(document.querySelectorAll('.all-features-list .all-features-item'), function (item) {
+    return item.innerText.trim();
+}).filter(Boolean);
+"""
+
+# Start payment and loan breakdown in one WebDriver command. Tries the same
+# selectors, in the same order, as the per-element lookups it replaces: the
+# first non-empty payment amount wins, and breakdown rows come from the first
+# section where a title/value selector pair yields any rows.
+_PAYMENT_JS = """
+return (function () {
+    function visible(el) { return el ? el.innerText.trim() : ''; }
+    var paymentSelectors = [
+        '#payment-result-value',
+        '.calculation-result.experience-embedded',
+        "[data-qa='payment-amount']",
+        '.payment-amount',
+        '.monthly-payment'
+    ];
+    var sectionSelectors = [
+        '.breakdown-section-details--grid, .breakdown-section-details--summary-grid',
+        '.payment-breakdown',
+        '.loan-breakdown',
+        "[data-qa='payment-breakdown']"
+    ];
+    var rowSelectors = [
+        ['dt.breakdown-section-details--title', 'dd.breakdown-section-details--value'],
+        ['.breakdown-title', '.breakdown-value'],
+        ['dt', 'dd'],
+        ['.title', '.value']
+    ];
+    var amount = null;
+    for (var i = 0; i < paymentSelectors.length && !amount; i++) {
+        amount = visible(document.querySelector(paymentSelectors[i])) || null;
+    }
+    var breakdown = [];
+    for (var s = 0; s < sectionSelectors.length && !breakdown.length; s++) {
+        var sections = document.querySelectorAll(sectionSelectors[s]);
+        for (var k = 0; k < sections.length && !breakdown.length; k++) {
+            for (var r = 0; r < rowSelectors.length; r++) {
+                var titles = sections[k].querySelectorAll(rowSelectors[r][0]);
+                var values = sections[k].querySelectorAll(rowSelectors[r][1]);
+                if (!titles.length || !values.length) { continue; }
+                for (var n = 0; n < Math.min(titles.length, values.length); n++) {
+                    var title = visible(titles[n]);
+                    var value = visible(values[n]);
+                    if (title && value) { breakdown.push([title, value]); }
+                }
+                break;
+            }
+        }
+    }
+    return {amount: amount, breakdown: breakdown};
+})();
+"""
 
 # --- Car Detail Scraper ---
-def scrape_car_details(driver, url):
+def scrape_car_details(driver, url, ts=None):
+    car_id = car_id_from_url(url)
     max_retries = 2  # Reduced from 3 to 2
     for attempt in range(max_retries):
         try:
             if not load_page_with_retry(driver, url):
-                car_id = url.split('/vehicledetail/')[1].split('/')[0] if '/vehicledetail/' in url else url
                 return {"id": car_id, "error": "Failed to load page"}
 
+            # Sold or removed listings redirect to a search page; reloading won't help
+            if '/vehicledetail/' not in driver.current_url:
+                return {"id": car_id, "error": "Redirected away from detail page"}
+
             # Wait for page to load with shorter timeout
             try:
-                WebDriverWait(driver, 15).until(  # Reduced from 20 to 15
-                    EC.presence_of_element_located((By.CSS_SELECTOR, ".basics-section"))
-                )
+                wait_for_selector(driver, ".basics-section", 15)  # Reduced from 20 to 15
             except TimeoutException:
-                return {"id": url.split('/vehicledetail/')[1].split('/')[0] if '/vehicledetail/' in url else url, "error": "Page structure not found"}
+                return {"id": car_id, "error": "Page structure not found"}
             
             # Wait for price element to be present
             try:
-                WebDriverWait(driver, 10).until(
-                    EC.presence_of_element_located((By.CSS_SELECTOR, "span[data-qa='primary-price']"))
-                )
+                wait_for_selector(driver, "span[data-qa='primary-price']", 10)
             except TimeoutException:
                 pass
             
-            car_id = url.split('/vehicledetail/')[1].split('/')[0] if '/vehicledetail/' in url else url
-            title = get_detail_text(driver, "h1.listing-title")
+            data = driver.execute_script(_DETAIL_JS)
+            title = data["title"]
             car_data = {
                 "id": car_id,
                 "title": title,
-                "price": get_detail_text(driver, "span[data-qa='primary-price']")
+                "price": data["price"]
             }
 
             # Parse title to extract year, make, and model
@@ -204,68 +401,30 @@ def scrape_car_details(driver, url):
             car_data.update(title_parts)  # Add year, make, and model to car_data
 
             # --- Basics Section ---
-            try:
-                dl_element = WebDriverWait(driver, 8).until(  # Reduced from 10 to 8
-                    EC.presence_of_element_located((By.CSS_SELECTOR, ".basics-section dl.fancy-description-list"))
-                )
-                dt_elements = dl_element.find_elements(By.TAG_NAME, "dt")
-                dd_elements = dl_element.find_elements(By.TAG_NAME, "dd")
-                for dt, dd in zip(dt_elements, dd_elements):
-                    try:
-                        # Sanitize the key to be a valid database column name
-                        raw_key = dt.text.strip().lower()
-                        # Remove special characters and replace spaces with underscores
-                        sanitized_key = re.sub(r'[^a-z0-9\s]', '', raw_key)
-                        key = sanitized_key.replace(' ', '_')
-                        
-                        value = dd.text.strip()
-                        if key and value:
-                            # Clean mileage value if this is the mileage field
-                            if key == 'mileage':
-                                value = clean_mileage(value)
-                            car_data[key] = value
-                    except StaleElementReferenceException:
-                        continue
-            except Exception as e:
-                pass
-            
+            for raw_key, value in data["basics"]:
+                key = sanitize_key(raw_key)
+                if key and value:
+                    # Clean mileage value if this is the mileage field
+                    if key == 'mileage':
+                        value = clean_mileage(value)
+                    car_data[key] = value
+
             # --- Features Section ---
-            try:
-                features_dl = WebDriverWait(driver, 8).until(  # Reduced from 10 to 8
-                    EC.presence_of_element_located((By.CSS_SELECTOR, ".features-section dl.fancy-description-list"))
-                )
-                features_dt_elements = features_dl.find_elements(By.TAG_NAME, "dt")
-                features_dd_elements = features_dl.find_elements(By.TAG_NAME, "dd")
-                for dt, dd in zip(features_dt_elements, features_dd_elements):
-                    try:
-                        category = dt.text.strip().lower().replace(" ", "_")
-                        feature_items = dd.find_elements(By.CSS_SELECTOR, "ul.vehicle-features-list li")
-                        features_list = [item.text.strip() for item in feature_items if item.text.strip()]
-                        if category and features_list:
-                            car_data[f"features_{category}"] = "; ".join(features_list)
-                    except StaleElementReferenceException:
-                        continue
-            except Exception as e:
-                pass
-            
+            for raw_category, features_list in data["features"]:
+                category = raw_category.lower().replace(" ", "_")
+                if category and features_list:
+                    car_data[f"features_{category}"] = "; ".join(features_list)
+
             # --- Additional Popular Features ---
-            try:
-                additional_features_element = driver.find_element(By.CSS_SELECTOR, ".auto-corrected-feature-list")
-                additional_features_text = additional_features_element.text.strip()
-                if additional_features_text:
-                    car_data["additional_popular_features"] = additional_features_text
-            except Exception as e:
-                pass
-            
+            if data["additional"]:
+                car_data["additional_popular_features"] = data["additional"]
+
             # --- All Features from Modal ---
             try:
                 view_all_features_btn = driver.find_element(By.CSS_SELECTOR, "spark-button[data-target='#allFeaturesModal']")
                 driver.execute_script("arguments[0].click();", view_all_features_btn)
-                WebDriverWait(driver, 3).until(  # Reduced from 5 to 3
-                    EC.presence_of_element_located((By.CSS_SELECTOR, ".all-features-list"))
-                )
-                all_features_elements = driver.find_elements(By.CSS_SELECTOR, ".all-features-list .all-features-item")
-                all_features_list = [element.text.strip() for element in all_features_elements if element.text.strip()]
+                wait_for_selector(driver, ".all-features-list", 3)  # Reduced from 5 to 3
+                all_features_list = driver.execute_script(_ALL_FEATURES_JS)
                 if all_features_list:
                     car_data["all_features"] = "; ".join(all_features_list)
                 close_btn = driver.find_element(By.CSS_SELECTOR, ".sds-modal .btn-close")
@@ -274,52 +433,19 @@ def scrape_car_details(driver, url):
                 pass
             
             # --- Images ---
-            try:
-                image_data = []
-                images = driver.find_elements(By.CSS_SELECTOR, "gallery-thumbnails img")
-                for img in images:
-                    try:
-                        src = img.get_attribute("src")
-                        if src:
-                            # Replace /small/ with /medium/ for a higher resolution image
-                            src = src.replace('/small/', '/medium/')
-                        
-                        modal_src = img.get_attribute("modal-src")
-                        alt = img.get_attribute("alt")
-                        if src:
-                            image_info = {
-                                "src": src,
-                                "modal_src": modal_src if modal_src else src,
-                                "alt": alt if alt else ""
-                            }
-                            image_data.append(image_info)
-                    except Exception as e:
-                        continue
-                if image_data:
-                    car_data["images"] = json.dumps(image_data)
-            except Exception as e:
-                pass
-            
+            image_data = []
+            for src, modal_src, alt in data["images"]:
+                if src:
+                    # Replace /small/ with /medium/ for a higher resolution image
+                    src = src.replace('/small/', '/medium/')
+                    image_data.append({"src": src, "modal_src": modal_src or src, "alt": alt or ""})
+            if image_data:
+                car_data["images"] = orjson.dumps(image_data).decode()
+
             # --- Payment Information ---
             try:
-                # Extract start payment amount - try multiple selectors
-                payment_selectors = [
-                    "#payment-result-value",
-                    ".calculation-result.experience-embedded",
-                    "[data-qa='payment-amount']",
-                    ".payment-amount",
-                    ".monthly-payment"
-                ]
-                
-                payment_text = None
-                for selector in payment_selectors:
-                    try:
-                        payment_element = driver.find_element(By.CSS_SELECTOR, selector)
-                        payment_text = payment_element.text.strip()
-                        if payment_text:
-                            break
-                    except:
-                        continue
+                payment = driver.execute_script(_PAYMENT_JS)
+                payment_text = payment["amount"]
                 
                 if payment_text:
                     # Clean and store just the numeric payment amount
@@ -328,75 +454,17 @@ def scrape_car_details(driver, url):
                 else:
                     car_data["start_payment"] = "Not available"
                 
-                # Extract breakdown details - try multiple approaches
                 breakdown_data = {}
-                
-                # Try different breakdown section selectors
-                breakdown_selectors = [
-                    ".breakdown-section-details--grid, .breakdown-section-details--summary-grid",
-                    ".payment-breakdown",
-                    ".loan-breakdown",
-                    "[data-qa='payment-breakdown']"
-                ]
-                
-                breakdown_found = False
-                for selector in breakdown_selectors:
-                    try:
-                        breakdown_sections = driver.find_elements(By.CSS_SELECTOR, selector)
-                        if breakdown_sections:
-                            for section in breakdown_sections:
-                                try:
-                                    # Try different title/value selectors
-                                    title_selectors = [
-                                        "dt.breakdown-section-details--title",
-                                        ".breakdown-title",
-                                        "dt",
-                                        ".title"
-                                    ]
-                                    value_selectors = [
-                                        "dd.breakdown-section-details--value",
-                                        ".breakdown-value",
-                                        "dd",
-                                        ".value"
-                                    ]
-                                    
-                                    for title_sel, value_sel in zip(title_selectors, value_selectors):
-                                        try:
-                                            dt_elements = section.find_elements(By.CSS_SELECTOR, title_sel)
-                                            dd_elements = section.find_elements(By.CSS_SELECTOR, value_sel)
-                                            
-                                            if dt_elements and dd_elements:
-                                                for dt, dd in zip(dt_elements, dd_elements):
-                                                    try:
-                                                        title = dt.text.strip()
-                                                        value = dd.text.strip()
-                                                        if title and value:
-                                                            # Clean the title for use as a key
-                                                            clean_title = re.sub(r'[^a-zA-Z0-9\s]', '', title).strip().lower().replace(' ', '_')
-                                                            # Clean monetary values in the breakdown
-                                                            if any(keyword in clean_title for keyword in ['price', 'payment', 'amount', 'paid', 'value']):
-                                                                value = clean_payment(value)
-                                                            breakdown_data[clean_title] = value
-                                                    except StaleElementReferenceException:
-                                                        continue
-                                                break  # If we found elements with this selector pair, stop trying others
-                                        except:
-                                            continue
-                                    
-                                    if breakdown_data:
-                                        breakdown_found = True
-                                        break
-                                except Exception as e:
-                                    continue
-                        
-                        if breakdown_found:
-                            break
-                    except:
-                        continue
+                for title, value in payment["breakdown"]:
+                    clean_title = breakdown_key(title)
+                    # Clean monetary values in the breakdown
+                    if any(keyword in clean_title for keyword in ['price', 'payment', 'amount', 'paid', 'value']):
+                        value = clean_payment(value)
+                    breakdown_data[clean_title] = value
                 
                 # Store breakdown as JSON string
                 if breakdown_data:
-                    car_data["payment_breakdown"] = json.dumps(breakdown_data)
+                    car_data["payment_breakdown"] = orjson.dumps(breakdown_data).decode()
                 else:
                     car_data["payment_breakdown"] = "No breakdown available"
                     
@@ -406,10 +474,8 @@ def scrape_car_details(driver, url):
                 pass
             
             # --- Bodystyle Extraction from External Links Section ---
-            try:
-                a_tag = driver.find_element(By.CSS_SELECTOR, "a.sds-link--ext[data-linkname='check-recalls']")
-                href = a_tag.get_attribute("href")
-
+            href = data["bodystyle_href"]
+            if href:
                 # Only parse if URL has query part
                 bodystyle = None
                 if '?' in href:
@@ -419,72 +485,154 @@ def scrape_car_details(driver, url):
 
                 # Optional fallback
                 if not bodystyle:
-                    match = re.search(r'bodystyle=([^&]+)', href)
+                    match = _BODYSTYLE_RE.search(href)
                     if match:
                         bodystyle = match.group(1)
 
                 if bodystyle:
                     car_data['bodystyle'] = bodystyle
-                else:
-                    pass
 
-            except Exception as e:
-                pass
-            
             # Add status and timestamp
             car_data["status_flag"] = "New Entry"
-            car_data["last_updated"] = time.strftime("%Y-%m-%d %H:%M:%S")
+            car_data["last_updated"] = ts or time.strftime("%Y-%m-%d %H:%M:%S")
             
             return car_data
             
-        except Exception as e:
+        except TimeoutException as e:
+            # A page that timed out once will most likely time out again
+            return {"id": car_id, "error": str(e)[:200]}  # Truncate error message
+        except (WebDriverException, ConnectionError) as e:
+            # Stale elements, browser hiccups and dropped connections are worth one more try
             error_msg = str(e)
-            if "connection" in error_msg.lower() or "timeout" in error_msg.lower():
-                if attempt < max_retries - 1:
-                    time.sleep(2)  # Wait longer for connection issues
-                    continue
-            else:
-                if attempt < max_retries - 1:
-                    time.sleep(1)  # Reduced from 2 to 1 second for other errors
-                    continue
-            
-            car_id = url.split('/vehicledetail/')[1].split('/')[0] if '/vehicledetail/' in url else url
+            if attempt < max_retries - 1:
+                time.sleep(2 if "connection" in error_msg.lower() else 1)  # Wait longer for connection issues
+                continue
             return {"id": car_id, "error": error_msg[:200]}  # Truncate error message
+        except Exception as e:
+            return {"id": car_id, "error": str(e)[:200]}  # Truncate error message
     return None
 
+# (filter key, query parameter) in URL order; list filters repeat as "name[]"
+_URL_FIELDS = [
+    ("stock_type", "stock_type"),
+    ("makes", "makes[]"),
+    ("models", "models[]"),
+    ("list_price_min", "list_price_min"),
+    ("list_price_max", "list_price_max"),
+    ("zip_code", "zip"),
+    ("max_distance", "maximum_distance"),
+    ("year_min", "year_min"),
+    ("year_max", "year_max"),
+    ("mileage_max", "mileage_max"),
+    ("body_styles", "body_style_slugs[]"),
+    ("fuel_types", "fuel_slugs[]"),
+]
+
+# Scrolls to the bottom until the page stops growing. Each step waits for
+# 200ms without DOM mutations (at most ~1s) instead of a fixed sleep, and the
+# whole loop runs in the browser as one WebDriver command, bounded below the
+# 30s script timeout.
+_SCROLL_JS = """
+var done = arguments[arguments.length - 1];
+var deadline = Date.now() + 20000;
+var last = document.body.scrollHeight;
+var stepStart = Date.now();
+var timer = null;
+var observer = new MutationObserver(settle);
+function settle() {
+    if (timer !== null && Date.now() - stepStart > 1000) { return; }
+    clearTimeout(timer);
+    timer = setTimeout(check, 200);
+}
+function check() {
+    timer = null;
+    var height = document.body.scrollHeight;
+    if (height === last || Date.now() > deadline) {
+        observer.disconnect();
+        done(height);
+        return;
+    }
+    last = height;
+    stepStart = Date.now();
+    window.scrollTo(0, height);
+    settle();
+}
+observer.observe(document.body, {childList: true, subtree: true});
+window.scrollTo(0, last);
+settle();
+"""
+
+# Detail links of every vehicle card on a results page, in one WebDriver command
+_CARD_LINKS_JS = """
+return Array.from(document.querySelectorAll('div.vehicle-card a.vehicle-card-link'), function (a) {
+    return a.href;
+}).filter(Boolean);
+"""
+
 def build_url(filters, page):
-    base_url = "https://www.cars.com/shopping/results/?"
-    params = []
-    if filters.get("stock_type"):
-        params.append(f"stock_type={filters['stock_type']}")
-    if filters.get("makes"):
-        for make in filters["makes"]:
-            params.append(f"makes[]={make}")
-    if filters.get("models"):
-        for model in filters["models"]:
-            params.append(f"models[]={model}")
-    if filters.get("list_price_min") is not None:
-        params.append(f"list_price_min={filters['list_price_min']}")
-    if filters.get("list_price_max") is not None:
-        params.append(f"list_price_max={filters['list_price_max']}")
-    if filters.get("zip_code"):
-        params.append(f"zip={filters['zip_code']}")
-    if filters.get("max_distance"):
-        params.append(f"maximum_distance={filters['max_distance']}")
-    if filters.get("year_min") is not None:
-        params.append(f"year_min={filters['year_min']}")
-    if filters.get("year_max") is not None:
-        params.append(f"year_max={filters['year_max']}")
-    if filters.get("mileage_max") is not None:
-        params.append(f"mileage_max={filters['mileage_max']}")
-    if filters.get("body_styles"):
-        for style in filters["body_styles"]:
-            params.append(f"body_style_slugs[]={style}")
-    if filters.get("fuel_types"):
-        for fuel in filters["fuel_types"]:
-            params.append(f"fuel_slugs[]={fuel}")
-    params.append(f"page={page}")
-    return base_url + "&".join(params)
+    params = [(name, filters[key]) for key, name in _URL_FIELDS if filters.get(key) not in (None, "", [])]
+    params.append(("page", page))
+    # Brackets stay literal as before; values are now properly escaped
+    return "https://www.cars.com/shopping/results/?" + urllib.parse.urlencode(params, doseq=True, safe="[]")
+
+# Results pages loaded at once while collecting listing links
+_MAX_PAGE_WORKERS = 4
+
+def _page_links(driver, url):
+    """Listing links on one results page, or None if the page would not load"""
+    _count_use(driver)
+    if not load_page_with_retry(driver, url):
+        return None
+    try:
+        wait_for_selector(driver, "div.vehicle-card", 10)
+    except TimeoutException:
+        # Past the last results page there are no cards to wait for
+        return []
+    try:
+        driver.execute_async_script(_SCROLL_JS)
+    except TimeoutException:
+        pass
+    # A card can hold more than one link to the same listing
+    return list(dict.fromkeys(driver.execute_script(_CARD_LINKS_JS)))
+
+def collect_links(filters, start_page, end_page):
+    """
+    Collect listing links from start_page to end_page, loading up to
+    _MAX_PAGE_WORKERS pages at once. Returns {page: links} in page order;
+    collection stops at the first page that fails to load or has no cards.
+    Raises ScraperError if start_page itself fails to load.
+    """
+    pages = range(start_page, end_page + 1)
+    idle = Queue()
+    def fetch(page):
+        try:
+            driver = idle.get_nowait()
+        except Empty:
+            driver = get_pooled_driver()
+        try:
+            return _page_links(driver, build_url(filters, page))
+        finally:
+            idle.put(driver)
+    page_links = {}
+    try:
+        with ThreadPoolExecutor(max_workers=min(_MAX_PAGE_WORKERS, len(pages))) as executor:
+            futures = [executor.submit(fetch, page) for page in pages]
+            try:
+                for page, future in zip(pages, futures):
+                    links = future.result()
+                    if links is None and page == start_page:
+                        raise ScraperError(f"Could not load results page {page}")
+                    if not links:
+                        break
+                    page_links[page] = links
+            finally:
+                # Pages after the last one kept are not loaded if not started yet
+                for future in futures:
+                    future.cancel()
+    finally:
+        while not idle.empty():
+            return_driver(idle.get_nowait())
+    return page_links
 
 def scrape_cars(
     stock_type: str = 'all',
@@ -500,11 +648,15 @@ def scrape_cars(
     body_styles=None,
     fuel_types=None,
     start_page: int = 1,
-    end_page: int = 1
+    end_page: int = 1,
+    skip_existing: bool = False,
+    on_car=None
 ):
     """
     Main scraper function that saves to CSV and returns the filename and data.
     Accepts all new filter fields and loops from start_page to end_page.
+    With skip_existing, cars already stored in WordPress are not scraped again.
+    on_car, if given, is called with each car as soon as it is scraped.
     """
     filters = {
         "stock_type": stock_type,
@@ -521,50 +673,25 @@ def scrape_cars(
         "fuel_types": fuel_types or []
     }
     logging.info(f"Scraping started with filters: {filters}")
-    main_driver = setup_driver()
-    all_links = []
-    try:
-        for page in range(start_page, end_page + 1):
-            url = build_url(filters, page)
-            if not load_page_with_retry(main_driver, url):
-                break
-            WebDriverWait(main_driver, 10).until(
-                EC.presence_of_all_elements_located((By.CSS_SELECTOR, "div.vehicle-card"))
-            )
-            last_height = main_driver.execute_script("return document.body.scrollHeight")
-            while True:
-                main_driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-                time.sleep(0.5)
-                new_height = main_driver.execute_script("return document.body.scrollHeight")
-                if new_height == last_height:
-                    break
-                last_height = new_height
-            cards = main_driver.find_elements(By.CSS_SELECTOR, "div.vehicle-card")
-            page_links = []
-            for card in cards:
-                try:
-                    link = card.find_element(By.CSS_SELECTOR, "a.vehicle-card-link").get_attribute('href')
-                    if link:
-                        page_links.append(link)
-                except:
-                    continue
-            all_links.extend(page_links)
-            if not page_links:
-                break
-    finally:
-        main_driver.quit()
+    # One timestamp for the whole run, shared by every car it scrapes
+    batch_ts = time.strftime("%Y-%m-%d %H:%M:%S")
+    page_links = collect_links(filters, start_page, end_page)
+    all_links = [link for links in page_links.values() for link in links]
     logging.info("Total links collected: %d", len(all_links))
+    if skip_existing and all_links:
+        existing = db.get_existing_ids(car_id_from_url(link) for link in all_links)
+        all_links = [link for link in all_links if car_id_from_url(link) not in existing]
+        logging.info("Skipping %d cars already stored in WordPress.", len(existing))
     total_links = len(all_links)
     logging.info(f"Found {total_links} car links to process.")
     scraped_data = []
     errors = []
-    max_workers = min(4, len(all_links))
+    max_workers = max(1, min(4, len(all_links)))
     with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        from queue import Queue
         driver_queue = Queue()
         for _ in range(max_workers):
             try:
-                driver = setup_driver()
+                driver = get_pooled_driver()
                 driver_queue.put(driver)
             except Exception as e:
                 logging.error(f"Error setting up driver: {e}")
@@ -572,7 +699,7 @@ def scrape_cars(
             driver = None
             try:
                 driver = driver_queue.get(timeout=10)
-                result = scrape_car_details(driver, link)
+                result = scrape_car_details(driver, link, ts=batch_ts)
                 if result and 'error' in result:
                     logging.error(f"Error scraping {link}: {result['error']}")
                     errors.append({"link": link, "error": result['error']})
@@ -593,13 +720,17 @@ def scrape_cars(
                 if driver:
                     try:
                         driver.current_url
-                        driver_queue.put(driver)
+                        worn_out = _count_use(driver) >= _MAX_DRIVER_USES
                     except:
+                        worn_out = True
+                    if worn_out:
+                        _quit_driver(driver)
                         try:
-                            new_driver = setup_driver()
-                            driver_queue.put(new_driver)
+                            driver = setup_driver()
                         except Exception:
-                            pass
+                            driver = None
+                    if driver:
+                        driver_queue.put(driver)
         futures = []
         for i, link in enumerate(all_links):
             future = executor.submit(scrape_with_driver, link, i)
@@ -609,6 +740,8 @@ def scrape_cars(
                 result = future.result(timeout=60)
                 if result:
                     scraped_data.append(result)
+                    if on_car:
+                        on_car(result)
                 if (i + 1) % 5 == 0 or (i + 1) == total_links:
                     logging.info(f"Processed {i + 1} of {total_links} cars...")
             except TimeoutException as e:
@@ -622,10 +755,9 @@ def scrape_cars(
                 errors.append({"link": all_links[i], "error": f"Unexpected error in future: {str(e)}"})
         while not driver_queue.empty():
             try:
-                driver = driver_queue.get_nowait()
-                driver.quit()
-            except:
-                pass
+                return_driver(driver_queue.get_nowait())
+            except Empty:
+                break
     if scraped_data:
         db.update_wordpress_database(scraped_data)
         logging.info("Scraping process completed successfully! %d records updated.", len(scraped_data))
@@ -634,4 +766,6 @@ def scrape_cars(
     logging.info(f"Scraping complete. Total cars processed: {total_links}")
     if errors:
         logging.error(f"Encountered {len(errors)} errors during scraping.")
-    return {"data": scraped_data, "errors": errors} 
\ No newline at end of file
+    # Listing ids found on each results page, so callers can split the run by page
+    pages = {page: [car_id_from_url(link) for link in links] for page, links in page_links.items()}
+    return {"data": scraped_data, "errors": errors, "pages": pages} 
\ No newline at end of file
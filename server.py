@@ -1,19 +1,32 @@
-from fastapi import FastAPI, HTTPException, Body, BackgroundTasks, Query, Request
-from fastapi.responses import JSONResponse
-from fastapi.middleware.cors import CORSMiddleware
+from fastapi import FastAPI, HTTPException, Body, Query, Request, Response
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
 from typing import List, Optional
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import os
+import time
+import asyncio
+import hashlib
+import functools
+import orjson
 import database as db
 import scraper as scraper
 import logging
 import traceback
 
 # --- FastAPI App Initialization ---
+# Interactive docs and the OpenAPI schema are only served in development
+ENV = os.getenv("ENV", "dev")
+
 app = FastAPI(
     title="Cars.com Scraper API",
     description="An API to trigger a web scraper for cars.com and manage data via WordPress REST APIs.",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    docs_url="/docs" if ENV == "dev" else None,
+    redoc_url=None,
+    openapi_url="/openapi.json" if ENV == "dev" else None
 )
 
 # --- Global Exception Handler ---
@@ -26,6 +39,11 @@ async def global_exception_handler(request: Request, exc: Exception):
         content={"detail": "Internal server error. Please check server logs for details."}
     )
 
+@app.exception_handler(scraper.ScraperError)
+async def scraper_error_handler(request: Request, exc: scraper.ScraperError):
+    logging.error(f"Scraper unavailable: {exc}")
+    return ORJSONResponse(status_code=502, content={"detail": "Scraper unavailable. Please try again later."})
+
 # --- CORS Configuration ---
 # Allows the WordPress frontend to communicate with this API
 origins = [
@@ -35,14 +53,89 @@ origins = [
     "https://onlineappflex.wpenginepowered.com",
     "https://onlineappflex.wpenginepowered.com/"
 ]
+# Origin header values as sent by browsers (no trailing slash), matched
+# against the raw ASGI header bytes
+ORIGINS_NORMALIZED = frozenset(o.rstrip('/').encode('ascii') for o in origins)
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+_CORS_METHODS = ("DELETE", "GET", "HEAD", "OPTIONS", "PATCH", "POST", "PUT")
+
+class FastCORS:
+    """
+    CORS for a fixed set of origin bytes, answering like CORSMiddleware with
+    credentials and all methods and headers allowed. Preflights are answered
+    from prebuilt headers without reaching the app, and browsers may cache
+    them for a day.
+    """
+    def __init__(self, app, origins):
+        self.app = app
+        self.origins = origins
+        self._preflight_headers = (
+            (b"vary", b"Origin"),
+            (b"access-control-allow-methods", ", ".join(_CORS_METHODS).encode()),
+            (b"access-control-max-age", b"86400"),
+            (b"access-control-allow-credentials", b"true"),
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        origin = request_method = request_headers = None
+        for name, value in scope["headers"]:
+            if name == b"origin":
+                origin = value
+            elif name == b"access-control-request-method":
+                request_method = value
+            elif name == b"access-control-request-headers":
+                request_headers = value
+        if origin is None:
+            await self.app(scope, receive, send)
+            return
+        allowed = origin in self.origins
+        if scope["method"] == "OPTIONS" and request_method is not None:
+            await self._preflight(send, origin if allowed else None, request_method, request_headers)
+            return
+
+        async def send_with_cors(message):
+            if message["type"] == "http.response.start":
+                # A new headers list: the response may reuse its own between calls
+                message = {**message, "headers": self._cors_headers(message.get("headers", []), origin if allowed else None)}
+            await send(message)
+
+        await self.app(scope, receive, send_with_cors)
+
+    @staticmethod
+    def _cors_headers(headers, origin):
+        cors = [(b"access-control-allow-credentials", b"true")]
+        if origin is None:
+            return [*headers, *cors]
+        vary = b"Origin"
+        kept = []
+        for name, value in headers:
+            if name == b"vary":
+                vary = value + b", Origin"
+            else:
+                kept.append((name, value))
+        return [*kept, *cors, (b"access-control-allow-origin", origin), (b"vary", vary)]
+
+    async def _preflight(self, send, origin, request_method, request_headers):
+        headers = list(self._preflight_headers)
+        failures = []
+        if origin is not None:
+            headers.append((b"access-control-allow-origin", origin))
+        else:
+            failures.append("origin")
+        if request_method.decode("latin-1") not in _CORS_METHODS:
+            failures.append("method")
+        if request_headers is not None:
+            headers.append((b"access-control-allow-headers", request_headers))
+        body = ("Disallowed CORS " + ", ".join(failures)).encode() if failures else b"OK"
+        headers.append((b"content-length", str(len(body)).encode()))
+        headers.append((b"content-type", b"text/plain; charset=utf-8"))
+        await send({"type": "http.response.start", "status": 400 if failures else 200, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+app.add_middleware(FastCORS, origins=ORIGINS_NORMALIZED)
 
 # --- API Models ---
 class ScrapeRequest(BaseModel):
@@ -60,52 +153,234 @@ class ScrapeRequest(BaseModel):
     fuel_types: Optional[List[str]] = Field(default=None, description="e.g., ['electric', 'hybrid']")
     start_page: int = Field(default=1, ge=1, description="The starting page number for scraping")
     end_page: int = Field(default=1, ge=1, description="The ending page number for scraping")
+    skip_existing: bool = Field(default=False, description="Skip cars already stored in WordPress")
 
 class ScrapeResponse(BaseModel):
     message: str
 
+# --- Helpers ---
+def _check_page_range(request: ScrapeRequest):
+    if request.end_page < request.start_page:
+        raise HTTPException(status_code=400, detail="End page cannot be less than start page.")
+
+# --- Scrape Result Cache ---
+# Identical scrape requests within _SCRAPE_TTL seconds share one run: callers
+# arriving while it is in flight await the same future, later ones get its
+# result. Failed runs are dropped so the next request retries.
+_SCRAPE_TTL = 300
+_SCRAPE_CACHE_SIZE = 32  # entries hold every scraped car, so keep few
+_SCRAPE_CACHE = OrderedDict()
+
+def _request_key(request: ScrapeRequest):
+    return hashlib.blake2b(orjson.dumps(request.model_dump(), option=orjson.OPT_SORT_KEYS), digest_size=16).digest()
+
+def _forget_failed(key, future):
+    if not future.cancelled():
+        if future.exception() is None:
+            return
+        logging.error(f"Scraping failed: {future.exception()}")
+    entry = _SCRAPE_CACHE.get(key)
+    if entry and entry[1] is future:
+        del _SCRAPE_CACHE[key]
+
+def _shared_scrape(request: ScrapeRequest):
+    """Future of the scrape for request, reusing a recent identical one"""
+    # No awaits in here, so lookup and insert can't interleave with another request
+    key = _request_key(request)
+    now = time.monotonic()
+    entry = _SCRAPE_CACHE.get(key)
+    if entry and now - entry[0] < _SCRAPE_TTL:
+        _SCRAPE_CACHE.move_to_end(key)
+        return entry[1]
+    future = asyncio.get_running_loop().create_future()
+    future.add_done_callback(functools.partial(_forget_failed, key))
+    _SCRAPE_QUEUE.put_nowait((request, future))
+    _SCRAPE_CACHE[key] = (now, future)
+    _SCRAPE_CACHE.move_to_end(key)
+    while len(_SCRAPE_CACHE) > _SCRAPE_CACHE_SIZE:
+        _SCRAPE_CACHE.popitem(last=False)
+    return future
+
+# --- Scrape Batching ---
+# Requests queued within _BATCH_WINDOW seconds of each other that differ only
+# in their page range, and whose ranges overlap or touch, run as one scrape
+# over the combined range; each caller then gets the cars from its own pages.
+# Ranges with a gap between them run separately, so no unrequested page is loaded.
+_SCRAPE_QUEUE = None  # created on startup, on the server's event loop
+_BATCH_WINDOW = 0.05
+_MAX_BATCH = 16
+_RUNNING_BATCHES = set()
+
+# Scrape runs get their own threads, at most SCRAPE_WORKERS at a time (each
+# run drives up to 8 Chrome processes); further runs wait their turn. The
+# default executor stays free for short blocking calls such as WordPress
+# status checks and shutdown flushes.
+_SCRAPE_POOL = ThreadPoolExecutor(
+    max_workers=int(os.getenv("SCRAPE_WORKERS", "1")),
+    thread_name_prefix="scrape"
+)
+
+def _filters_key(request: ScrapeRequest):
+    return orjson.dumps(request.model_dump(exclude={"start_page", "end_page"}), option=orjson.OPT_SORT_KEYS)
+
+def _pages_result(result, request: ScrapeRequest):
+    """The part of a merged scrape result that request asked for"""
+    pages = {
+        page: ids for page, ids in result["pages"].items()
+        if request.start_page <= page <= request.end_page
+    }
+    ids = {car_id for page_ids in pages.values() for car_id in page_ids}
+    return {
+        "data": [car for car in result["data"] if car.get("id") in ids],
+        "errors": [e for e in result["errors"] if scraper.car_id_from_url(e["link"]) in ids],
+        "pages": pages
+    }
+
+def _contiguous_groups(entries):
+    """Split (request, future) pairs into groups whose page ranges overlap or touch"""
+    entries = sorted(entries, key=lambda entry: entry[0].start_page)
+    groups = [[entries[0]]]
+    end_page = entries[0][0].end_page
+    for entry in entries[1:]:
+        request = entry[0]
+        if request.start_page <= end_page + 1:
+            groups[-1].append(entry)
+            end_page = max(end_page, request.end_page)
+        else:
+            groups.append([entry])
+            end_page = request.end_page
+    return groups
+
+async def _run_batch(group):
+    merged = group[0][0].model_copy(update={
+        "start_page": min(request.start_page for request, _ in group),
+        "end_page": max(request.end_page for request, _ in group)
+    })
+    loop = asyncio.get_running_loop()
+    try:
+        result = await loop.run_in_executor(_SCRAPE_POOL, functools.partial(scraper.scrape_cars, **merged.model_dump()))
+    except Exception as e:
+        for _, future in group:
+            if not future.done():
+                future.set_exception(e)
+        return
+    for request, future in group:
+        if not future.done():
+            future.set_result(_pages_result(result, request))
+
+async def _batch_scrapes():
+    """Consume queued scrape requests, running each batch of compatible ones as one scrape"""
+    while True:
+        batch = [await _SCRAPE_QUEUE.get()]
+        await asyncio.sleep(_BATCH_WINDOW)
+        while len(batch) < _MAX_BATCH and not _SCRAPE_QUEUE.empty():
+            batch.append(_SCRAPE_QUEUE.get_nowait())
+        groups = {}
+        for request, future in batch:
+            groups.setdefault(_filters_key(request), []).append((request, future))
+        for group in (g for entries in groups.values() for g in _contiguous_groups(entries)):
+            task = asyncio.create_task(_run_batch(group))
+            _RUNNING_BATCHES.add(task)
+            task.add_done_callback(_RUNNING_BATCHES.discard)
+
+@app.on_event("startup")
+async def start_scrape_batching():
+    global _SCRAPE_QUEUE
+    _SCRAPE_QUEUE = asyncio.Queue()
+    task = asyncio.create_task(_batch_scrapes())
+    _RUNNING_BATCHES.add(task)
+    task.add_done_callback(_RUNNING_BATCHES.discard)
+
+# --- Lifecycle ---
+@app.on_event("startup")
+async def warm_connections():
+    # Not awaited, so an unreachable WordPress doesn't hold up startup
+    asyncio.get_running_loop().run_in_executor(None, db.warm_session)
+
+@app.on_event("shutdown")
+async def release_resources():
+    # Send records still buffered for WordPress and quit idle Chrome drivers
+    await asyncio.to_thread(db.flush_pending)
+    await asyncio.to_thread(scraper.close_driver_pool)
+
 # --- API Endpoints ---
-@app.post("/scrape/", status_code=202)
-async def trigger_scraping(request: ScrapeRequest, background_tasks: BackgroundTasks):
+@app.post("/scrape/", status_code=202, response_model=ScrapeResponse)
+async def trigger_scraping(request: ScrapeRequest):
     """
-    Triggers the scraping process based on the provided filters.
-    This endpoint will run the scraper and save data to CSV, then update WordPress via REST API.
+    Accepts a scraping job and returns immediately.
+    The scraper runs in the background, saves data to CSV, then updates WordPress via REST API.
+    An identical job started in the last 5 minutes is not run again.
     """
-    try:
-        if request.end_page < request.start_page:
-            raise HTTPException(status_code=400, detail="End page cannot be less than start page.")
-
-        result = scraper.scrape_cars(
-            stock_type=request.stock_type,
-            makes=request.makes,
-            models=request.models,
-            zip_code=request.zip_code,
-            max_distance=request.max_distance,
-            list_price_min=request.list_price_min,
-            list_price_max=request.list_price_max,
-            year_min=request.year_min,
-            year_max=request.year_max,
-            mileage_max=request.mileage_max,
-            body_styles=request.body_styles,
-            fuel_types=request.fuel_types,
-            start_page=request.start_page,
-            end_page=request.end_page
-        )
-        
-        return {
-            "message": "Scraping process completed successfully!",
-            "cars_scraped": len(result['data'])
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {e}")
+    _check_page_range(request)
+    _shared_scrape(request)
+    return {"message": "Scraping started in the background."}
 
-@app.get("/wordpress-status/")
-async def get_wordpress_status():
+@app.post("/scrape/sync/")
+async def trigger_scraping_sync(request: ScrapeRequest, response: Response):
     """
-    Check if WordPress REST API is accessible.
+    Runs the scraper and waits for it to finish, returning the number of cars scraped.
+    The scrape runs in a worker thread so the server keeps answering other requests.
+    Results are reused for identical requests for 5 minutes.
     """
+    _check_page_range(request)
+    # Shielded so a disconnecting client doesn't cancel a run others await;
+    # failures are answered by the exception handlers above
+    result = await asyncio.shield(_shared_scrape(request))
+    response.headers["Cache-Control"] = f"max-age={_SCRAPE_TTL}"
+    return {
+        "message": "Scraping process completed successfully!",
+        "cars_scraped": len(result['data'])
+    }
+
+_STREAM_END = object()
+_STREAM_ERROR = orjson.dumps({"error": "Scraping failed. Please check server logs for details."}) + b"\n"
+
+@app.post("/scrape/stream/")
+async def stream_scraping(request: ScrapeRequest):
+    """
+    Scrapes like /scrape/sync/ but streams each car as a line of JSON as soon as it is scraped.
+    The scrape and its WordPress update finish even if the client disconnects early.
+    """
+    _check_page_range(request)
+    loop = asyncio.get_running_loop()
+    cars = asyncio.Queue()
+
+    def on_car(car):
+        # Encoded here, in the scrape thread: scrape_cars later hands the same
+        # dicts to the WordPress update, which pops last_updated from them
+        loop.call_soon_threadsafe(cars.put_nowait, orjson.dumps(car) + b"\n")
+
+    def on_done(future):
+        if not future.cancelled() and future.exception() is not None:
+            logging.error(f"Scraping failed: {future.exception()}")
+        cars.put_nowait(_STREAM_END)
+
+    scrape = loop.run_in_executor(_SCRAPE_POOL, functools.partial(scraper.scrape_cars, on_car=on_car, **request.model_dump()))
+    scrape.add_done_callback(on_done)
+
+    async def ndjson():
+        while True:
+            line = await cars.get()
+            if line is _STREAM_END:
+                break
+            yield line
+        # The cause is logged by on_done; clients only get a fixed message
+        if scrape.cancelled() or scrape.exception() is not None:
+            yield _STREAM_ERROR
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+# --- WordPress Status Cache ---
+# The status is checked against WordPress at most once per _STATUS_TTL
+# seconds; clients revalidate with the ETag and get 304 when it is unchanged.
+_STATUS_TTL = 15
+_STATUS_CACHE_CONTROL = f"public, max-age={_STATUS_TTL}, stale-while-revalidate=30"
+_status_cache = None  # (checked_at, body, etag)
+_status_refresh = None  # check in flight, shared by concurrent requests
+
+async def _wordpress_status():
     try:
-        cars_data = db.get_cars_data_from_wordpress(limit=5)
+        cars_data = await db.get_cars_data_from_wordpress_async(limit=5)
         return {
             "wordpress_accessible": True,
             "sample_data_count": len(cars_data),
@@ -118,21 +393,70 @@ async def get_wordpress_status():
             "message": "WordPress REST API is not accessible. Check your WordPress configuration."
         }
 
+async def _refresh_status():
+    global _status_cache, _status_refresh
+    try:
+        body = orjson.dumps(await _wordpress_status())
+        _status_cache = (time.monotonic(), body, f'"{hashlib.sha1(body).hexdigest()}"')
+    finally:
+        _status_refresh = None
+
+@app.get("/wordpress-status/")
+async def get_wordpress_status(request: Request):
+    """
+    Check if WordPress REST API is accessible.
+    """
+    global _status_refresh
+    if _status_cache is None or time.monotonic() - _status_cache[0] >= _STATUS_TTL:
+        if _status_refresh is None:
+            _status_refresh = asyncio.create_task(_refresh_status())
+        await asyncio.shield(_status_refresh)
+    _, body, etag = _status_cache
+    headers = {"Cache-Control": _STATUS_CACHE_CONTROL, "ETag": etag}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in (tag.strip() for tag in if_none_match.split(",")) or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# The health payload never changes, so it is encoded once. Each call still
+# gets its own Response, because middleware appends to a response's headers.
+_HEALTH_BYTES = orjson.dumps({
+    "status": "healthy",
+    "service": "Cars.com Scraper API",
+    "version": "1.0.0"
+})
+_HEALTH_HEADERS = {"Cache-Control": "public, max-age=10"}
+
 @app.get("/health/")
 async def health_check():
     """
     Health check endpoint to verify the API is running.
     """
-    return {
-        "status": "healthy",
-        "service": "Cars.com Scraper API",
-        "version": "1.0.0"
-    }
+    return Response(content=_HEALTH_BYTES, media_type="application/json", headers=_HEALTH_HEADERS)
 
 # --- Server Startup ---
 if __name__ == "__main__":
     import uvicorn
     print("🚀 Starting Cars.com Scraper API server...")
-    print("📡 Server will be available at: http://localhost:8000")
-    print("📚 API documentation at: http://localhost:8000/docs")
-    uvicorn.run(app, host="0.0.0.0", port=8000, reload=False) 
\ No newline at end of file
+    # With USE_UDS=1 a reverse proxy on the same host reaches the API over a
+    # UNIX domain socket, skipping the loopback TCP stack
+    if os.getenv("USE_UDS") == "1":
+        uds_path = os.getenv("UDS_PATH", "/tmp/scraper.sock")
+        bind = {"uds": uds_path}
+        print(f"📡 Server will be available on UNIX socket: {uds_path}")
+    else:
+        bind = {"host": "0.0.0.0", "port": 8000}
+        print("📡 Server will be available at: http://localhost:8000")
+        if ENV == "dev":
+            print("📚 API documentation at: http://localhost:8000/docs")
+    # uvicorn picks uvloop and httptools on its own where uvicorn[standard]
+    # installed them. The scrape cache, batching and Chrome pool live in each
+    # process, so one worker is the default; WEB_CONCURRENCY raises it.
+    # Access logging is off to save a write per request.
+    uvicorn.run(
+        "server:app",
+        **bind,
+        workers=int(os.getenv("WEB_CONCURRENCY", "1")),
+        log_level="warning",
+        access_log=False
+    )